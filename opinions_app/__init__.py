@@ -4,9 +4,17 @@ from flask_sqlalchemy import SQLAlchemy
 
 from settings import Config
 
+from .routing import RoutingSession
+
 app = Flask(__name__)
 app.config.from_object(Config)
-db = SQLAlchemy(app)
+# Сессия сама выбирает основную базу, реплику или шард.
+# Объекты не сбрасываются после commit: иначе мнение из шарда
+# перечитывалось бы следующим запросом уже из основной базы
+db = SQLAlchemy(
+    app,
+    session_options={'class_': RoutingSession, 'expire_on_commit': False}
+)
 migrate = Migrate(app, db)
 
 from . import api_views, cli_commands, error_handlers, views
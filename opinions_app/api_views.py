@@ -1,16 +1,19 @@
 from flask import jsonify, request
 
-from . import app, db
+from . import app, db, near_duplicates, shards
 from .error_handlers import InvalidAPIUsage
 from .models import Opinion
+from .routing import read_from_replica
 from .views import random_opinion
 
 
 # Явно разрешить метод GET
 @app.route('/api/opinions/<int:id>/', methods=['GET'])
+@read_from_replica
 def get_opinion(id):
     # Получить объект по id или выбросить ошибку
-    opinion = Opinion.query.get(id)
+    with shards.bind_for(id):
+        opinion = Opinion.query.get(id)
     if opinion is None:
         raise InvalidAPIUsage('Мнение с указанным id не найдено', 404)
     # Конвертировать данные в JSON и вернуть объект и код ответа API
@@ -20,22 +23,36 @@ def get_opinion(id):
 @app.route('/api/opinions/<int:id>/', methods=['PATCH'])
 def update_opinion(id):
     data = request.get_json()
-    opinion = Opinion.query.get(id)
+    with shards.bind_for(id):
+        opinion = Opinion.query.get(id)
     if opinion is None:
         raise InvalidAPIUsage('Мнение с указанным id не найдено', 404)
 
+    if 'text' in data and not isinstance(data['text'], str):
+        raise InvalidAPIUsage('Текст мнения должен быть строкой')
     if (
         'text' in data and
-        Opinion.query.filter_by(text=data['text']).first() is not None
+        shards.find_by_text(data['text']) is not None
     ):
         # При неуникальном значении поля text
         # возвращаем сообщение об ошибке в формате JSON
         # и статус-код 400
         raise InvalidAPIUsage('Такое мнение уже есть в базе данных')
+    if (
+        'text' in data and
+        near_duplicates.is_rejected(data['text'], exclude=id)
+    ):
+        raise InvalidAPIUsage('Похожее мнение уже есть в базе данных')
     opinion.title = data.get('title', opinion.title)
     opinion.text = data.get('text', opinion.text)
     opinion.source = data.get('source', opinion.source)
     opinion.added_by = data.get('added_by', opinion.added_by)
+    # Изменения записываются в шард мнения, а сигнатура — в основную базу;
+    # сигнатуру нужно пересчитать, только если изменился текст
+    with shards.bind_for(id):
+        db.session.flush()
+    if 'text' in data:
+        near_duplicates.add_to_index(opinion)
     # Все изменения нужно сохранить в базе данных
     db.session.commit()
     # При создании или изменении объекта вернём сам объект и код 201
@@ -44,19 +61,24 @@ def update_opinion(id):
 
 @app.route('/api/opinions/<int:id>/', methods=['DELETE'])
 def delete_opinion(id):
-    opinion = Opinion.query.get(id)
-    if opinion is None:
-        raise InvalidAPIUsage('Мнение с указанным id не найдено', 404)
-    db.session.delete(opinion)
+    with shards.bind_for(id):
+        opinion = Opinion.query.get(id)
+        if opinion is None:
+            raise InvalidAPIUsage('Мнение с указанным id не найдено', 404)
+        db.session.delete(opinion)
+        db.session.flush()
+    near_duplicates.remove_from_index(id)
     db.session.commit()
     # При удалении принято возвращать только код ответа 204
     return '', 204
 
 
 @app.route('/api/opinions/', methods=['GET'])
+@read_from_replica
 def get_opinions():
-    # Запрашивается список объектов
-    opinions = Opinion.query.all()
+    # Запрашивается список объектов;
+    # при шардировании он параллельно собирается из всех шардов
+    opinions = shards.all_opinions()
     # Поочерёдно сериализуется каждый объект,
     # а потом все объекты помещаются в список opinions_list
     opinions_list = [opinion.to_dict() for opinion in opinions]
@@ -73,15 +95,23 @@ def add_opinion():
         # Второй параметр (статус-код) можно не передавать:
         # нужно вернуть код 400, а именно он возвращается по умолчанию
         raise InvalidAPIUsage('В запросе отсутствуют обязательные поля')
-    if Opinion.query.filter_by(text=data['text']).first() is not None:
+    # Сравнивать на похожесть можно только текст
+    if not isinstance(data['text'], str):
+        raise InvalidAPIUsage('Текст мнения должен быть строкой')
+    if shards.find_by_text(data['text']) is not None:
         # Выбрасываем собственное исключение
         raise InvalidAPIUsage('Такое мнение уже есть в базе данных')
+    # Тексты, отличающиеся только пунктуацией или пробелами,
+    # тоже считаются повтором
+    if near_duplicates.is_rejected(data['text']):
+        raise InvalidAPIUsage('Похожее мнение уже есть в базе данных')
     # Создание нового пустого экземпляра модели
     opinion = Opinion()
     # Наполнение его данными из запроса
     opinion.from_dict(data)
-    # Добавление новой записи в базу данных
-    db.session.add(opinion)
+    # Добавление новой записи в базу данных (или в шард)
+    shards.add(opinion)
+    near_duplicates.add_to_index(opinion)
     # Сохранение изменений
     db.session.commit()
     return jsonify({'opinion': opinion.to_dict()}), 201
@@ -1,8 +1,13 @@
 import csv
+import os
 
 import click
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 
-from . import app, db
+from settings import sqlite_uri
+
+from . import app, db, near_duplicates, query_audit, shards
 from .models import Opinion
 
 
@@ -16,16 +21,160 @@ def load_opinions_command():
         reader = csv.DictReader(f)
         # Для подсчёта строк добавляется счётчик
         counter = 0
+        skipped = 0
         for row in reader:
+            # Почти одинаковые мнения в базу не попадают
+            if near_duplicates.is_rejected(row['text']):
+                skipped += 1
+                continue
             # Распакованный словарь можно использовать
             # для создания объекта мнения
             opinion = Opinion(**row)
+            shards.add(opinion)
+            near_duplicates.add_to_index(opinion)
             # Изменения нужно зафиксировать
-            db.session.add(opinion)
             db.session.commit()
             counter += 1
     click.echo(f'Загружено мнений: {counter}')
+    if skipped:
+        click.echo(f'Пропущено похожих мнений: {skipped}')
     # Если пользовательская команда подразумевает
     # вывод текстовых данных в консоль или файл,
     # рекомендуется использовать функцию click.echo(), а не print().
     # Функция click.echo() корректно работает с Unicode в Windows.
+
+
+@app.cli.command('find_duplicates')
+@click.option('--threshold', type=float,
+              help='Порог сходства; по умолчанию из настроек.')
+@click.option('--rebuild', is_flag=True,
+              help='Пересчитать сигнатуры всех мнений.')
+def find_duplicates_command(threshold, rebuild):
+    """Функция поиска групп почти одинаковых мнений."""
+    if threshold is None:
+        threshold = app.config['NEAR_DUPLICATE_THRESHOLD']
+    if rebuild:
+        count = near_duplicates.build_index()
+        click.echo(f'Пересчитано сигнатур: {count}')
+    clusters = near_duplicates.load_index().clusters(threshold)
+    for cluster in clusters:
+        opinions = []
+        for key in shards.keys():
+            with shards.bind(key):
+                opinions += Opinion.query.filter(
+                    Opinion.id.in_(cluster)
+                ).all()
+        click.echo(f'Группа из {len(opinions)} мнений:')
+        for opinion in opinions:
+            click.echo(f'  {opinion.id}: {opinion.title} — '
+                       f'{opinion.text[:60]}')
+    click.echo(f'Найдено групп: {len(clusters)}')
+
+
+@app.cli.command('db-audit')
+@click.option('--baseline', type=click.Path(dir_okay=False),
+              help='JSON-файл с уже известными проблемами планов.')
+@click.option('--update-baseline', is_flag=True,
+              help='Записать найденные проблемы в файл baseline.')
+@click.option('--migration', is_flag=True,
+              help='Создать ревизию Alembic с предложенными индексами.')
+def db_audit_command(baseline, update_baseline, migration):
+    """Функция аудита планов запросов приложения."""
+    # Запросы собираются из событий SQLAlchemy во время прогона приложения
+    # на временной базе с тестовыми мнениями
+    known = query_audit.load_baseline(baseline)
+    found = set()
+    new_problems = 0
+    suggested = []
+    with query_audit.throwaway_databases():
+        shapes = query_audit.replay_app_queries()
+        indexed = query_audit.existing_indexes()
+        for statement, (engine, parameters) in shapes.items():
+            plan, problems = query_audit.audit_statement(
+                engine, statement, parameters
+            )
+            click.echo(' '.join(statement.split()))
+            for detail in plan:
+                click.echo(f'    {detail}')
+            for problem in problems:
+                found.add(problem['key'])
+                is_new = problem['key'] not in known
+                new_problems += is_new
+                label = 'NEW' if is_new else 'known'
+                click.echo(f'  [{label}] {problem["detail"]}')
+                index = problem['index']
+                if index is not None and index not in indexed:
+                    if index not in suggested:
+                        suggested.append(index)
+                    click.echo(f'    -> индекс на {index[0]}.{index[1]}')
+                if problem['hint'] is not None:
+                    click.echo(f'    -> {problem["hint"]}')
+            click.echo()
+    click.echo(f'Запросов: {len(shapes)}, проблем: {len(found)}, '
+               f'новых: {new_problems}')
+    if migration and suggested:
+        path = query_audit.write_migration_stub(suggested)
+        click.echo(f'Создана миграция: {path}')
+    if update_baseline:
+        if baseline is None:
+            raise click.UsageError('Для --update-baseline нужен --baseline')
+        query_audit.save_baseline(baseline, found)
+        click.echo(f'Baseline обновлён: {baseline}')
+    elif new_problems:
+        # Ненулевой код выхода позволяет использовать команду в CI
+        raise SystemExit(1)
+
+
+@app.cli.command('sync_replicas')
+def sync_replicas_command():
+    """Функция копирования основной базы данных в реплики."""
+    primary = db.engines[None].raw_connection()
+    try:
+        for number, name in enumerate(app.config['DATABASE_REPLICAS']):
+            replica = db.engines[f'replica_{number}'].raw_connection()
+            try:
+                # Онлайн-копия средствами SQLite: основная база
+                # остаётся доступной во время копирования
+                primary.driver_connection.backup(replica.driver_connection)
+            finally:
+                replica.close()
+            click.echo(f'Реплика обновлена: {name}')
+    finally:
+        primary.close()
+
+
+@app.cli.command('init_shards')
+def init_shards_command():
+    """Функция создания таблиц в шардах."""
+    if not app.config['DATABASE_SHARDS']:
+        raise click.UsageError('Шарды не настроены: задайте DATABASE_SHARDS')
+    shards.init_schema()
+    click.echo(f'Шардов подготовлено: {len(app.config["DATABASE_SHARDS"])}')
+
+
+@app.cli.command('rebalance_shards')
+@click.option('--from-primary', is_flag=True,
+              help='Перенести в шарды мнения из основной базы данных.')
+@click.option('--source', multiple=True,
+              help='Файл базы, убранной из DATABASE_SHARDS; можно повторять.')
+def rebalance_shards_command(from_primary, source):
+    """Функция переноса мнений в шарды по их id."""
+    if not app.config['DATABASE_SHARDS']:
+        raise click.UsageError('Шарды не настроены: задайте DATABASE_SHARDS')
+    extra_sources = []
+    for name in source:
+        uri = sqlite_uri(name)
+        # SQLite молча создаст пустой файл вместо опечатки в имени
+        if not os.path.exists(make_url(uri).database):
+            raise click.BadParameter(
+                f'файл базы {name} не найден', param_hint='--source'
+            )
+        extra_sources.append(create_engine(uri))
+    if from_primary:
+        extra_sources.append(db.engines[None])
+    try:
+        moved = shards.rebalance(extra_sources)
+    except shards.ShardConflict as error:
+        # Конфликтующая запись не перезаписывается: её нужно разобрать вручную
+        raise click.ClickException(str(error))
+    click.echo(f'Перенесено мнений: {moved}')
@@ -39,3 +39,19 @@ class Opinion(db.Model):
                 # Если есть — добавляем значение из словаря
                 # в соответствующее поле объекта модели:
                 setattr(self, field, data[field])
+
+
+class OpinionSignature(db.Model):
+    # MinHash-сигнатура мнения для поиска почти одинаковых текстов.
+    # Внешнего ключа нет: при шардировании мнения лежат в других базах
+    opinion_id = db.Column(db.Integer, primary_key=True)
+    # Список из NUM_PERM чисел в формате JSON
+    signature = db.Column(db.Text, nullable=False)
+
+
+class OpinionBucket(db.Model):
+    # LSH-корзина: мнения с одинаковой полосой сигнатуры попадают
+    # в одну корзину, поиск кандидатов идёт по индексу на bucket
+    id = db.Column(db.Integer, primary_key=True)
+    opinion_id = db.Column(db.Integer, index=True, nullable=False)
+    bucket = db.Column(db.String(32), index=True, nullable=False)
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import random
+import re
+
+from flask import current_app
+
+from . import db, shards
+from .models import Opinion, OpinionBucket, OpinionSignature
+
+# 128 хеш-функций делятся на 32 полосы по 4 строки:
+# кандидаты находятся уже при сходстве около 0.42,
+# а окончательное решение принимается по оценке сходства сигнатур
+NUM_PERM = 128
+BANDS = 32
+SHINGLE_SIZE = 5
+# Простое число Мерсенна для универсального хеширования
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Всё, что не буква и не цифра (кириллица и латиница), заменяется пробелом
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Приводит текст к виду, не зависящему от регистра и пунктуации."""
+    text = text.lower().replace('ё', 'е')
+    return NON_WORD_RE.sub(' ', text).strip()
+
+
+def is_comparable(text):
+    """Есть ли в тексте буквы или цифры, по которым можно сравнивать.
+
+    Тексты из одной пунктуации или эмодзи нормализуются в пустую строку
+    и все получили бы одну и ту же сигнатуру; для них остаётся
+    только проверка на точное совпадение.
+    """
+    return bool(normalize(text))
+
+
+def shingles(text):
+    """Множество символьных шинглов нормализованного текста."""
+    text = normalize(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {
+        text[i:i + SHINGLE_SIZE]
+        for i in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+
+class MinHashIndex:
+    """MinHash-сигнатуры мнений и LSH-корзины в памяти.
+
+    Рабочий индекс хранится в таблицах OpinionSignature и OpinionBucket;
+    в памяти он собирается только для пакетного поиска групп.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Коэффициенты хеш-функций фиксированы, чтобы сигнатуры,
+        # сохранённые в базе, оставались сравнимыми между запусками
+        generator = random.Random(num_perm)
+        self.permutations = [
+            (generator.randrange(1, MERSENNE_PRIME),
+             generator.randrange(0, MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self.signatures = {}
+        self.buckets = {}
+
+    def signature(self, text):
+        hashes = [
+            int.from_bytes(
+                hashlib.blake2b(shingle.encode('utf-8'),
+                                digest_size=4).digest(),
+                'little'
+            )
+            for shingle in shingles(text)
+        ]
+        return [
+            min((a * h + b) % MERSENNE_PRIME & MAX_HASH for h in hashes)
+            for a, b in self.permutations
+        ]
+
+    def split_bands(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, tuple(signature[start:start + self.rows])
+
+    def similarity(self, first, second):
+        """Оценка коэффициента Жаккара по двум сигнатурам."""
+        same = sum(x == y for x, y in zip(first, second))
+        return same / self.num_perm
+
+    def clusters(self, threshold):
+        """Группы id, связанные попарным сходством не ниже порога."""
+        parents = {id: id for id in self.signatures}
+
+        def find(id):
+            while parents[id] != id:
+                parents[id] = parents[parents[id]]
+                id = parents[id]
+            return id
+
+        for bucket in self.buckets.values():
+            bucket = sorted(bucket)
+            for i, first in enumerate(bucket):
+                for second in bucket[i + 1:]:
+                    if find(first) == find(second):
+                        continue
+                    similarity = self.similarity(
+                        self.signatures[first], self.signatures[second]
+                    )
+                    if similarity >= threshold:
+                        parents[find(second)] = find(first)
+        groups = {}
+        for id in parents:
+            groups.setdefault(find(id), []).append(id)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Индекс в памяти из пар (id, сигнатура в JSON)."""
+        index = cls()
+        for id, signature in rows:
+            signature = json.loads(signature)
+            index.signatures[id] = signature
+            for key in index.split_bands(signature):
+                index.buckets.setdefault(key, set()).add(id)
+        return index
+
+
+# Считает сигнатуры для записи в базу и для поиска
+HASHER = MinHashIndex()
+
+
+def bucket_keys(signature):
+    """Строковые ключи LSH-корзин сигнатуры, по одному на полосу."""
+    return [
+        f'{band}:' + hashlib.blake2b(
+            repr(rows).encode('utf-8'), digest_size=8
+        ).hexdigest()
+        for band, rows in HASHER.split_bands(signature)
+    ]
+
+
+def _store(id, text):
+    if not is_comparable(text):
+        return
+    signature = HASHER.signature(text)
+    db.session.add(OpinionSignature(
+        opinion_id=id, signature=json.dumps(signature)
+    ))
+    db.session.add_all(
+        OpinionBucket(opinion_id=id, bucket=bucket)
+        for bucket in bucket_keys(signature)
+    )
+
+
+def _delete(id):
+    OpinionSignature.query.filter_by(opinion_id=id).delete()
+    OpinionBucket.query.filter_by(opinion_id=id).delete()
+
+
+def build_index():
+    """Пересчитывает сигнатуры всех мнений из базы данных (или шардов)."""
+    OpinionSignature.query.delete()
+    OpinionBucket.query.delete()
+    count = 0
+    for key in shards.keys():
+        with shards.bind(key):
+            rows = db.session.query(Opinion.id, Opinion.text).all()
+        for id, text in rows:
+            _store(id, text)
+            count += 1
+    db.session.commit()
+    return count
+
+
+def load_index():
+    """Все сохранённые сигнатуры в виде индекса в памяти (для CLI)."""
+    rows = db.session.query(
+        OpinionSignature.opinion_id, OpinionSignature.signature
+    ).all()
+    return MinHashIndex.from_rows(rows)
+
+
+def find_similar(text, exclude=None):
+    """Самое похожее мнение (id, сходство) выше порога или None.
+
+    Кандидаты выбираются по индексу на OpinionBucket.bucket,
+    поэтому сравниваются только мнения из общих LSH-корзин.
+    """
+    if not is_comparable(text):
+        return None
+    threshold = current_app.config['NEAR_DUPLICATE_THRESHOLD']
+    signature = HASHER.signature(text)
+    candidates = db.session.query(OpinionBucket.opinion_id).filter(
+        OpinionBucket.bucket.in_(bucket_keys(signature))
+    )
+    if exclude is not None:
+        candidates = candidates.filter(OpinionBucket.opinion_id != exclude)
+    rows = db.session.query(
+        OpinionSignature.opinion_id, OpinionSignature.signature
+    ).filter(OpinionSignature.opinion_id.in_(candidates)).all()
+    matches = [
+        (id, HASHER.similarity(signature, json.loads(stored)))
+        for id, stored in rows
+    ]
+    matches = [match for match in matches if match[1] >= threshold]
+    if matches:
+        return max(matches, key=lambda match: match[1])
+    return None
+
+
+def is_rejected(text, exclude=None):
+    """Проверяет текст и решает, нужно ли отклонить мнение.
+
+    В режиме 'flag' похожее мнение только записывается в лог.
+    """
+    match = find_similar(text, exclude=exclude)
+    if match is None:
+        return False
+    if current_app.config['NEAR_DUPLICATE_MODE'] == 'flag':
+        current_app.logger.warning(
+            'Мнение похоже на мнение %s (сходство %.2f)', *match
+        )
+        return False
+    return True
+
+
+def add_to_index(opinion):
+    """Добавляет в сессию сигнатуру нового или изменённого мнения.
+
+    Вызывается после записи мнения (flush) и вне shards.bind():
+    таблицы индекса лежат в основной базе. Без шардирования
+    сигнатура фиксируется тем же commit, что и само мнение.
+    """
+    _delete(opinion.id)
+    _store(opinion.id, opinion.text)
+
+
+def remove_from_index(id):
+    """Удаляет сигнатуру мнения; commit делает вызывающий код."""
+    _delete(id)
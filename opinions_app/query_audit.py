@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from alembic.script import ScriptDirectory
+from alembic.util import rev_id
+from sqlalchemy import create_engine, event, text
+
+from . import app, db, near_duplicates, shards
+from .models import Opinion
+
+# Планы запросов, которые считаются проблемными:
+# полный проход по таблице и временное B-дерево для сортировки/группировки
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+TEMP_BTREE_RE = re.compile(r'USE TEMP B-TREE FOR (.+)$')
+# Условия вида «opinion.title = ?» в WHERE
+EQUALITY_RE = re.compile(r'(\w+)\.(\w+)\s*=\s*\?')
+ORDER_BY_RE = re.compile(r'ORDER BY\s+(\w+)\.(\w+)', re.IGNORECASE)
+# Анализируются только запросы, которые читают таблицы
+AUDITED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+# Мнения, которыми заполняется временная база перед прогоном
+FIXTURES = [
+    dict(title='Фильм 1', text='Первое тестовое мнение для аудита'),
+    dict(title='Фильм 2', text='Второе тестовое мнение, совсем другое'),
+    dict(title='Фильм 3', text='Third audit fixture about a movie'),
+]
+
+
+class QueryRecorder:
+    """Собирает уникальные формы SQL-запросов через события SQLAlchemy."""
+
+    def __init__(self, engines):
+        self.engines = engines
+        # Ключ — текст запроса с плейсхолдерами,
+        # значение — движок, на котором он выполнился, и первые параметры
+        self.shapes = {}
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if statement.lstrip().upper().startswith(AUDITED_STATEMENTS):
+            self.shapes.setdefault(statement, (conn.engine, parameters))
+
+    @contextmanager
+    def capture(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._record)
+        try:
+            yield self
+        finally:
+            for engine in self.engines:
+                event.remove(engine, 'before_cursor_execute', self._record)
+
+
+@contextmanager
+def throwaway_databases():
+    """Подменяет все базы приложения временными файлами SQLite.
+
+    Таблицы создаются по моделям и заполняются FIXTURES, поэтому прогон
+    не зависит от содержимого рабочей базы и ничего в неё не пишет.
+    """
+    # Flask-SQLAlchemy 3.0 не умеет пересоздавать движки для уже
+    # настроенного приложения, поэтому словарь движков подменяется на месте
+    engines = db._app_engines[app]
+    original = dict(engines)
+    db.session.remove()
+    with tempfile.TemporaryDirectory() as directory:
+        primary = create_engine(f'sqlite:///{directory}/primary.sqlite3')
+        for key in original:
+            if key is None or key.startswith('replica_'):
+                # Реплики читают те же данные, что и основная база
+                engines[key] = primary
+            else:
+                engines[key] = create_engine(
+                    f'sqlite:///{directory}/{key}.sqlite3'
+                )
+        try:
+            for engine in set(engines.values()):
+                db.metadata.create_all(engine)
+            for fixture in FIXTURES:
+                opinion = Opinion(**fixture)
+                shards.add(opinion)
+                near_duplicates.add_to_index(opinion)
+            db.session.commit()
+            db.session.remove()
+            yield
+        finally:
+            db.session.remove()
+            for engine in set(engines.values()):
+                engine.dispose()
+            engines.clear()
+            engines.update(original)
+
+
+def replay_app_queries():
+    """Прогоняет через тестовый клиент запросы, которые делает приложение.
+
+    Вызывается внутри throwaway_databases(). Пишущие обработчики получают
+    уже существующий текст, чтобы сработали проверки на дубликат, а затем
+    новое мнение создаётся, изменяется и удаляется.
+    """
+    # Слушаются все базы: основная, реплики и шарды
+    recorder = QueryRecorder(set(db.engines.values()))
+    csrf_enabled = app.config.get('WTF_CSRF_ENABLED', True)
+    app.config['WTF_CSRF_ENABLED'] = False
+    opinion = shards.find_by_text(FIXTURES[0]['text'])
+    id = opinion.id
+    duplicate = {'title': opinion.title, 'text': opinion.text}
+    calls = [
+        ('GET', '/', None),
+        ('GET', f'/opinions/{id}', None),
+        ('GET', '/api/opinions/', None),
+        ('GET', f'/api/opinions/{id}/', None),
+        ('GET', '/api/get-random-opinion/', None),
+        ('POST', '/api/opinions/', {'json': duplicate}),
+        ('PATCH', f'/api/opinions/{id}/', {'json': duplicate}),
+        ('POST', '/add', {'data': duplicate}),
+    ]
+    client = app.test_client()
+
+    def call(method, url, kwargs=None):
+        # Сессия сбрасывается, чтобы get() не брал объект из кэша
+        # сессии и действительно обращался к базе
+        db.session.remove()
+        return client.open(url, method=method, **(kwargs or {}))
+
+    try:
+        with recorder.capture():
+            for method, url, kwargs in calls:
+                call(method, url, kwargs)
+            # Успешная запись: вставка, поиск похожих, запись сигнатуры,
+            # затем изменение текста и удаление нового мнения
+            response = call('POST', '/api/opinions/', {'json': {
+                'title': 'Новый фильм',
+                'text': 'Свежее мнение, которого ещё нет в базе аудита',
+            }})
+            new_id = response.get_json()['opinion']['id']
+            call('PATCH', f'/api/opinions/{new_id}/', {'json': {
+                'text': 'Another fresh opinion written during the audit',
+            }})
+            call('DELETE', f'/api/opinions/{new_id}/')
+    finally:
+        app.config['WTF_CSRF_ENABLED'] = csrf_enabled
+        db.session.remove()
+    return recorder.shapes
+
+
+def explain(engine, statement, parameters):
+    """Возвращает строки EXPLAIN QUERY PLAN для запроса."""
+    with engine.connect() as connection:
+        cursor = connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, parameters
+        )
+        # Последний столбец — текстовое описание шага плана
+        return [row[-1] for row in cursor]
+
+
+def suggest_index(statement, table, kind):
+    """Подбирает индекс, который избавит запрос от найденной проблемы."""
+    if kind == 'temp-btree':
+        match = ORDER_BY_RE.search(statement)
+        if match is not None and match.group(1) == table:
+            return (table, match.group(2))
+        return None
+    where = statement.upper().find('WHERE')
+    if where == -1:
+        return None
+    for match in EQUALITY_RE.finditer(statement[where:]):
+        if match.group(1) == table:
+            return (table, match.group(2))
+    return None
+
+
+def audit_statement(engine, statement, parameters):
+    """Анализирует план одного запроса и возвращает список проблем."""
+    plan = explain(engine, statement, parameters)
+    digest = hashlib.sha1(statement.encode('utf-8')).hexdigest()[:12]
+    problems = []
+    for detail in plan:
+        scan = SCAN_RE.match(detail)
+        temp_btree = TEMP_BTREE_RE.search(detail)
+        # Ключ для baseline строится из вида проблемы и таблицы,
+        # а не из текста плана: формулировки меняются между версиями SQLite
+        if scan is not None:
+            table, kind = scan.group(1), 'scan'
+        elif temp_btree is not None:
+            table, kind = _first_table(statement), 'temp-btree'
+        else:
+            continue
+        if kind == 'scan' and 'OFFSET' in statement.upper():
+            hint = ('OFFSET читает все пропущенные строки: '
+                    'выбирайте запись по диапазону id')
+        else:
+            hint = None
+        problems.append(dict(
+            key=f'{digest}: {kind} {table}',
+            detail=detail,
+            index=suggest_index(statement, table, kind),
+            hint=hint,
+        ))
+    return plan, problems
+
+
+def _first_table(statement):
+    match = re.search(r'\bFROM\s+(\w+)', statement, re.IGNORECASE)
+    return match.group(1) if match is not None else None
+
+
+def load_baseline(path):
+    if path is None or not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return set(json.load(f))
+
+
+def save_baseline(path, keys):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(sorted(keys), f, ensure_ascii=False, indent=2)
+
+
+def write_migration_stub(indexes):
+    """Создаёт в migrations/versions ревизию Alembic с индексами."""
+    config = app.extensions['migrate'].migrate.get_config()
+    script = ScriptDirectory.from_config(config)
+    revision = rev_id()
+    down_revision = script.get_current_head()
+    upgrades = '\n'.join(
+        f"    op.create_index('ix_{table}_{column}', '{table}', "
+        f"['{column}'], unique=False)"
+        for table, column in indexes
+    )
+    downgrades = '\n'.join(
+        f"    op.drop_index('ix_{table}_{column}', table_name='{table}')"
+        for table, column in reversed(indexes)
+    )
+    content = (
+        '"""db-audit suggested indexes\n\n'
+        f'Revision ID: {revision}\n'
+        f'Revises: {down_revision or ""}\n'
+        f'Create Date: {datetime.now()}\n\n'
+        '"""\n'
+        'from alembic import op\n\n'
+        '# revision identifiers, used by Alembic.\n'
+        f'revision = {revision!r}\n'
+        f'down_revision = {down_revision!r}\n'
+        'branch_labels = None\n'
+        'depends_on = None\n\n\n'
+        'def upgrade():\n'
+        '    # ### generated by flask db-audit - please adjust! ###\n'
+        f'{upgrades}\n'
+        '    # ### end db-audit commands ###\n\n\n'
+        'def downgrade():\n'
+        '    # ### generated by flask db-audit - please adjust! ###\n'
+        f'{downgrades}\n'
+        '    # ### end db-audit commands ###\n'
+    )
+    path = os.path.join(
+        script.versions, f'{revision}_db_audit_suggested_indexes.py'
+    )
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return path
+
+
+def existing_indexes():
+    """Множество (таблица, столбец) уже проиндексированных столбцов."""
+    indexed = set()
+    with db.engine.connect() as connection:
+        for table in db.metadata.tables:
+            indexes = connection.execute(
+                text(f'PRAGMA index_list("{table}")')
+            ).fetchall()
+            for index in indexes:
+                columns = connection.execute(
+                    text(f'PRAGMA index_info("{index[1]}")')
+                ).fetchall()
+                if len(columns) == 1:
+                    indexed.add((table, columns[0][2]))
+    return indexed
@@ -0,0 +1,116 @@
+import os
+import random
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+
+class RoutingSession(Session):
+    """Сессия, которая выбирает базу данных для каждого запроса.
+
+    Если в ``info['bind_key']`` задан ключ, все запросы идут в эту базу
+    (так работают шарды). Иначе, если в ``info['replica_key']`` выбрана
+    реплика, SELECT отправляется в неё, а запись — в основную базу.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            key = self.info.get('bind_key')
+            if key is not None:
+                return self._db.engines[key]
+            replica_key = self.info.get('replica_key')
+            if (
+                replica_key is not None and
+                not self._flushing and
+                isinstance(clause, sa.Select)
+            ):
+                return self._db.engines[replica_key]
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs
+        )
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def remember_write(db_session, flush_context):
+    # Клиент, который только что что-то записал, какое-то время
+    # читает из основной базы, чтобы сразу видеть свои изменения.
+    # Без реплик это не нужно, а без SECRET_KEY сессию не сохранить
+    if (
+        has_request_context() and
+        current_app.config['DATABASE_REPLICAS'] and
+        current_app.secret_key
+    ):
+        session['last_write'] = time.time()
+
+
+def is_sticky():
+    """Проверяет, писал ли клиент в базу совсем недавно."""
+    if not has_request_context():
+        return False
+    last_write = session.get('last_write')
+    if last_write is None:
+        return False
+    sticky_seconds = current_app.config['REPLICA_STICKY_SECONDS']
+    return time.time() - last_write < sticky_seconds
+
+
+def is_fresh(engines, key):
+    """Проверяет, что реплика отстаёт не больше REPLICA_MAX_LAG секунд.
+
+    Время синхронизации — время изменения файла реплики: sync_replicas
+    перезаписывает его целиком. Если основная база с тех пор
+    не менялась, реплика актуальна независимо от возраста.
+    """
+    replica = engines[key].url.database
+    if not os.path.exists(replica) or not os.path.getsize(replica):
+        return False
+    synced_at = os.path.getmtime(replica)
+    if os.path.getmtime(engines[None].url.database) <= synced_at:
+        return True
+    return time.time() - synced_at <= current_app.config['REPLICA_MAX_LAG']
+
+
+def read_from_replica(func):
+    """Декоратор: запросы на чтение внутри функции идут в реплику.
+
+    Реплика выбирается одна на весь вызов, чтобы связанные запросы
+    (например, count и offset) видели одни и те же данные.
+    Устаревшие реплики пропускаются, а при ошибке реплики
+    функция повторяется на основной базе.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        db = current_app.extensions['sqlalchemy']
+        db_session = db.session
+        replicas = []
+        if not is_sticky():
+            replicas = [
+                f'replica_{number}'
+                for number in range(
+                    len(current_app.config['DATABASE_REPLICAS'])
+                )
+            ]
+            replicas = [key for key in replicas if is_fresh(db.engines, key)]
+        previous = db_session.info.get('replica_key')
+        db_session.info['replica_key'] = (
+            random.choice(replicas) if replicas else None
+        )
+        try:
+            return func(*args, **kwargs)
+        except sa.exc.DBAPIError:
+            replica_key = db_session.info['replica_key']
+            if replica_key is None:
+                raise
+            current_app.logger.warning(
+                'Реплика %s недоступна, чтение из основной базы', replica_key
+            )
+            db_session.rollback()
+            db_session.info['replica_key'] = None
+            return func(*args, **kwargs)
+        finally:
+            db_session.info['replica_key'] = previous
+    return wrapper
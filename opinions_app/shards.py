@@ -0,0 +1,194 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import func, orm, select
+from sqlalchemy.exc import IntegrityError
+
+from . import app, db
+from .models import Opinion
+
+# Сколько раз пробовать новый id, если его успел занять другой запрос
+ID_ATTEMPTS = 10
+
+
+class ShardConflict(Exception):
+    """Мнение нельзя перенести: в шарде уже есть другая запись."""
+
+
+def keys():
+    """Ключи баз, в которых лежат мнения.
+
+    Без шардирования это единственный ключ None — основная база.
+    """
+    count = len(app.config['DATABASE_SHARDS'])
+    if not count:
+        return [None]
+    return [f'shard_{number}' for number in range(count)]
+
+
+def shard_for(id):
+    """Ключ шарда, в котором хранится мнение с данным id."""
+    shard_keys = keys()
+    return shard_keys[id % len(shard_keys)]
+
+
+@contextmanager
+def bind(key):
+    """Направляет все запросы сессии в базу с ключом key."""
+    previous = db.session.info.get('bind_key')
+    db.session.info['bind_key'] = key
+    try:
+        yield
+    finally:
+        db.session.info['bind_key'] = previous
+
+
+def bind_for(id):
+    return bind(shard_for(id))
+
+
+def find_by_text(text):
+    """Ищет мнение с таким текстом во всех шардах."""
+    for key in keys():
+        with bind(key):
+            opinion = Opinion.query.filter_by(text=text).first()
+        if opinion is not None:
+            return opinion
+    return None
+
+
+def next_id(number, count):
+    """Следующий свободный id, который попадает в шард number.
+
+    Максимум берётся и по основной базе: в ней могут оставаться мнения,
+    ещё не перенесённые rebalance_shards, и их id нельзя занимать.
+    """
+    max_id = 0
+    for key in [None] + keys():
+        with bind(key):
+            shard_max = db.session.query(func.max(Opinion.id)).scalar()
+        max_id = max(max_id, shard_max or 0)
+    return max_id + 1 + (number - max_id - 1) % count
+
+
+def _insert_with_new_id(opinion, number, count):
+    for attempt in range(ID_ATTEMPTS):
+        opinion.id = next_id(number, count)
+        db.session.add(opinion)
+        try:
+            db.session.flush()
+            return
+        except IntegrityError:
+            db.session.rollback()
+            # id выбирается без блокировки, и параллельный запрос мог
+            # успеть его занять; другие ошибки повторять бесполезно
+            if (
+                attempt == ID_ATTEMPTS - 1 or
+                db.session.get(Opinion, opinion.id) is None
+            ):
+                raise
+
+
+def add(opinion):
+    """Записывает новое мнение в основную базу или в случайный шард.
+
+    В шарде id назначается так, чтобы id % число шардов
+    совпадал с номером шарда. Запись выполняется через flush,
+    чтобы у мнения появился id; commit делает вызывающий код.
+    """
+    shard_keys = keys()
+    number = random.randrange(len(shard_keys))
+    with bind(shard_keys[number]):
+        if shard_keys[number] is None:
+            db.session.add(opinion)
+            db.session.flush()
+        else:
+            _insert_with_new_id(opinion, number, len(shard_keys))
+
+
+def _load_all(engine):
+    # У каждого потока своя сессия, привязанная к движку шарда
+    with orm.Session(engine) as shard_session:
+        return shard_session.scalars(select(Opinion)).all()
+
+
+def all_opinions():
+    """Все мнения: параллельно собираются из всех шардов."""
+    shard_keys = keys()
+    if shard_keys == [None]:
+        return Opinion.query.all()
+    engines = [db.engines[key] for key in shard_keys]
+    with ThreadPoolExecutor(max_workers=len(engines)) as executor:
+        results = executor.map(_load_all, engines)
+    opinions = [opinion for result in results for opinion in result]
+    return sorted(opinions, key=lambda opinion: opinion.id)
+
+
+def init_schema():
+    """Создаёт таблицы в шардах и помечает их текущей ревизией Alembic.
+
+    Шарды создаются по моделям, а не миграциями, поэтому следующие
+    миграции к ним нужно применять отдельно (см. README).
+    """
+    config = app.extensions['migrate'].migrate.get_config()
+    script = ScriptDirectory.from_config(config)
+    for key in keys():
+        engine = db.engines[key]
+        db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            context = MigrationContext.configure(connection)
+            if context.get_current_revision() is None:
+                context.stamp(script, 'head')
+
+
+def rebalance(extra_sources=()):
+    """Переносит мнения в шард, соответствующий их id.
+
+    Кроме текущих шардов, мнения забираются из extra_sources —
+    движков баз, которые больше не входят в список шардов
+    (например, основной базы или убранного шарда).
+    Запись, которая уже лежит в целевом шарде, просто удаляется
+    из источника; если там другая запись с тем же id или текстом,
+    выбрасывается ShardConflict. Возвращает число перенесённых мнений.
+    """
+    table = Opinion.__table__
+    shard_keys = keys()
+    init_schema()
+    sources = [(key, db.engines[key]) for key in shard_keys]
+    sources += [(None, engine) for engine in extra_sources]
+    moved = 0
+    for source, engine in sources:
+        with engine.connect() as connection:
+            rows = connection.execute(select(table)).mappings().all()
+        for row in rows:
+            target = shard_for(row['id'])
+            if target == source:
+                continue
+            # Сначала запись в новый шард, затем удаление из старого:
+            # при сбое повторный запуск увидит уже перенесённую строку
+            with db.engines[target].begin() as connection:
+                existing = connection.execute(
+                    select(table).where(table.c.id == row['id'])
+                ).mappings().first()
+                if existing is not None and dict(existing) != dict(row):
+                    raise ShardConflict(
+                        f'Мнение {row["id"]}: в {target} уже есть '
+                        f'другая запись с этим id'
+                    )
+                if existing is None:
+                    try:
+                        connection.execute(table.insert(), dict(row))
+                    except IntegrityError as error:
+                        raise ShardConflict(
+                            f'Мнение {row["id"]}: в {target} уже есть '
+                            f'мнение с таким текстом'
+                        ) from error
+            with engine.begin() as connection:
+                connection.execute(
+                    table.delete().where(table.c.id == row['id'])
+                )
+            moved += 1
+    return moved
@@ -2,17 +2,28 @@ from random import randrange
 
 from flask import abort, flash, redirect, render_template, url_for
 
-from . import app, db
+from . import app, db, near_duplicates, shards
 from .forms import OpinionForm
 from .models import Opinion
+from .routing import read_from_replica
 
 
+@read_from_replica
 def random_opinion():
-    quantity = Opinion.query.count()
+    # При шардировании мнения считаются в каждом шарде отдельно
+    quantities = []
+    for key in shards.keys():
+        with shards.bind(key):
+            quantities.append(Opinion.query.count())
+    quantity = sum(quantities)
     if quantity:
         offset_value = randrange(quantity)
-        opinion = Opinion.query.offset(offset_value).first()
-        return opinion
+        # Смещение переводится в номер записи внутри нужного шарда
+        for key, shard_quantity in zip(shards.keys(), quantities):
+            if offset_value < shard_quantity:
+                with shards.bind(key):
+                    return Opinion.query.offset(offset_value).first()
+            offset_value -= shard_quantity
 
 
 @app.route('/')
@@ -30,11 +41,14 @@ def add_opinion_view():
     if form.validate_on_submit():
         text = form.text.data
         # Если в БД уже есть мнение с текстом, который ввёл пользователь,
-        if Opinion.query.filter_by(text=text).first() is not None:
+        if shards.find_by_text(text) is not None:
             # вызвать функцию flash и передать соответствующее сообщение
             flash('Такое мнение уже было оставлено ранее!', 'free-message') # free-message - это категория flash сообщения(для шаблона), если flash не один
             # и вернуть пользователя на страницу «Добавить новое мнение»
             return render_template('add_opinion.html', form=form)
+        if near_duplicates.is_rejected(text):
+            flash('Похожее мнение уже было оставлено ранее!', 'free-message')
+            return render_template('add_opinion.html', form=form)
         # нужно создать новый экземпляр класса Opinion
         opinion = Opinion(
             title=form.title.data,
@@ -43,7 +57,9 @@ def add_opinion_view():
             added_by = form.added_by.data
         )
         # Затем добавить его в сессию работы с базой данных
-        db.session.add(opinion)
+        # (в основной базе или в шарде)
+        shards.add(opinion)
+        near_duplicates.add_to_index(opinion)
         # И зафиксировать изменения
         db.session.commit()
         # Затем перейти на страницу добавленного мнения
@@ -54,6 +70,7 @@ def add_opinion_view():
 @app.route('/opinions/<int:id>')
 def opinion_view(id):
     # Теперь можно запрашивать мнение по id
-    opinion = Opinion.query.get_or_404(id)
+    with shards.bind_for(id):
+        opinion = Opinion.query.get_or_404(id)
     # И передавать его в шаблон
     return render_template('opinion.html', opinion=opinion)
@@ -3,6 +3,19 @@ from pathlib import Path
 
 BASE_DIR = Path(__file__).parent
 
+
+def sqlite_uri(name):
+    return 'sqlite:///'+f'{BASE_DIR}\\'+name
+
+
+def database_list(variable):
+    # Список файлов баз данных через запятую
+    return [name for name in os.getenv(variable, '').split(',') if name]
+
+
+DATABASE_REPLICAS = database_list('DATABASE_REPLICAS')
+DATABASE_SHARDS = database_list('DATABASE_SHARDS')
+
 class Config(object):
     # SQLALCHEMY_DATABASE_URI = 'sqlite:///db.sqlite3'
     # SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -11,7 +24,28 @@ class Config(object):
 
     SQLALCHEMY_DATABASE_URI = 'sqlite:///'+f'{BASE_DIR}\\'+os.getenv('DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Реплики только для чтения (например, копии файла основной базы)
+    # и шарды, по которым мнения раскладываются по id % числу шардов
+    DATABASE_REPLICAS = DATABASE_REPLICAS
+    DATABASE_SHARDS = DATABASE_SHARDS
+    SQLALCHEMY_BINDS = {
+        **{f'replica_{number}': sqlite_uri(name)
+           for number, name in enumerate(DATABASE_REPLICAS)},
+        **{f'shard_{number}': sqlite_uri(name)
+           for number, name in enumerate(DATABASE_SHARDS)},
+    }
+    # Сколько секунд после записи клиент читает из основной базы
+    REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+    # Насколько реплика может отставать от основной базы, в секундах;
+    # более старые реплики не используются до следующего sync_replicas
+    REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', 60))
     SECRET_KEY = os.getenv('SECRET_KEY')
+    # Поиск почти одинаковых мнений (MinHash/LSH)
+    NEAR_DUPLICATE_THRESHOLD = float(
+        os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8)
+    )
+    # 'reject' — отклонять похожие мнения, 'flag' — только писать в лог
+    NEAR_DUPLICATE_MODE = os.getenv('NEAR_DUPLICATE_MODE', 'reject')
 
 
 # create.env file with data:
@@ -20,3 +54,5 @@ class Config(object):
 # FLASK_DEBUG=1
 # DATABASE_URI=opinions_app\\db.sqlite3
 # SECRET_KEY=YOUR_SECRET_KEY
+# DATABASE_REPLICAS=opinions_app\\replica_1.sqlite3,opinions_app\\replica_2.sqlite3
+# DATABASE_SHARDS=opinions_app\\shard_1.sqlite3,opinions_app\\shard_2.sqlite3